@@ -1,3 +1,4 @@
+import numpy as np
 import trimesh
 
 # === CHEMINS DES FICHIERS À COMPARER ===
@@ -6,14 +7,14 @@ recon_path = "output/levelSet_hom_align.stl"
 gt_path = "data/gt_stl/01/01_AORTE_arteries.stl"
 
 print("[INFO] Chargement des deux maillages...")
-# === Chargement des deux maillages ===
-mesh_recon = trimesh.load_mesh(recon_path)
-mesh_gt = trimesh.load_mesh(gt_path)
+# === Chargement des deux maillages (sans fusion des sommets, inutile pour une bounding box) ===
+mesh_recon = trimesh.load_mesh(recon_path, process=False)
+mesh_gt = trimesh.load_mesh(gt_path, process=False)
 
 print("[INFO] Calcul des bounding boxes...")
-# === Calcul des bounding boxes ===
-bbox_recon = mesh_recon.bounding_box.extents
-bbox_gt = mesh_gt.bounding_box.extents
+# === Calcul des bounding boxes (étendue des sommets, sans construire la primitive Box) ===
+bbox_recon = np.ptp(mesh_recon.vertices, axis=0)
+bbox_gt = np.ptp(mesh_gt.vertices, axis=0)
 
 # === Affichage des tailles ===
 print("=== TAILLES (Bounding Box Dimensions) ===")
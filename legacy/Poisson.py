@@ -4,6 +4,7 @@ import SimpleITK as sitk
 from skimage import measure
 import open3d as o3d
 import trimesh
+from _resample import isotropic_resample
 
 # === CONFIGURATION ===
 nii_path = "data/01/label.nii"  # Fichier NIfTI binaire segmenté
@@ -13,21 +14,10 @@ target_spacing = [0.5, 0.5, 0.5]  # Voxel isotrope recommandé
 def reconstruct():
     # === 1. Lecture du fichier NIfTI avec SimpleITK ===
     img = sitk.ReadImage(nii_path)
-    original_spacing = img.GetSpacing()
-    original_size = img.GetSize()
-    new_size = [
-        int(round(original_size[i] * (original_spacing[i] / target_spacing[i])))
-        for i in range(3)
-    ]
 
     # === 2. Rééchantillonnage vers des voxels isotropes ===
-    resampler = sitk.ResampleImageFilter()
-    resampler.SetOutputSpacing(target_spacing)
-    resampler.SetSize(new_size)
-    resampler.SetOutputDirection(img.GetDirection())
-    resampler.SetOutputOrigin(img.GetOrigin())
-    resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-    img_iso = resampler.Execute(img)
+    # Sans recadrage : les sommets de marching_cubes sont exprimés dans le repère de la grille complète
+    img_iso = isotropic_resample(img, target_spacing, crop=False)
 
     # === 3. Conversion en array numpy ===
     volume = sitk.GetArrayFromImage(img_iso)  # (z, y, x)
@@ -0,0 +1,34 @@
+import numpy as np
+import SimpleITK as sitk
+
+def isotropic_resample(img, spacing=(0.5, 0.5, 0.5), crop=True):
+    """Rééchantillonne une segmentation en voxels isotropes (plus proche voisin).
+
+    Avec crop=True, seule la portion de la grille cible couvrant la boîte englobante du premier plan
+    (marge d'un voxel pour garder la surface fermée) est calculée. Le recadrage se fait sur la grille
+    cible (origine décalée d'un nombre entier de voxels cibles) : il ne retire que des voxels vides
+    et ne déplace jamais la surface par rapport au resampling complet.
+    """
+    spacing = np.array([float(s) for s in spacing])
+    src_spacing = np.array(img.GetSpacing())
+    size = np.array(img.GetSize())
+    origin = np.array(img.GetOrigin())
+    direction = np.array(img.GetDirection()).reshape(3, 3)
+
+    # Grille cible complète : indices [0, n_full)
+    lo_k = np.zeros(3, dtype=int)
+    hi_k = np.ceil(size * src_spacing / spacing).astype(int)
+    if crop:
+        stats = sitk.LabelShapeStatisticsImageFilter()
+        stats.Execute(img != 0)
+        if stats.HasLabel(1):
+            bbox = np.array(stats.GetBoundingBox(1))
+            lo = np.maximum(bbox[:3] - 1, 0)
+            hi = np.minimum(bbox[:3] + bbox[3:] + 1, size)
+            # Bornes physiques de la boîte (en voxels source) ramenées à des indices de la grille cible
+            lo_k = np.floor(lo * src_spacing / spacing).astype(int)
+            hi_k = np.minimum(np.ceil(hi * src_spacing / spacing).astype(int), hi_k)
+
+    new_origin = origin + direction @ (lo_k * spacing)
+    return sitk.Resample(img, (hi_k - lo_k).tolist(), sitk.Transform(), sitk.sitkNearestNeighbor,
+                         new_origin.tolist(), spacing.tolist(), img.GetDirection(), 0.0, img.GetPixelID())
@@ -8,23 +8,50 @@ recon_path = "output/maillage_aligne.stl"  # mesh reconstruit à la bonne échel
 gt_path = "data/gt_stl/01/01_AORTE_arteries.stl"
 output_aligned_path = "output/levelSet_hom_align5.stl"
 
+# ICP via l'API tensorielle d'Open3D sur GPU si Open3D a été compilé avec CUDA, sinon pipeline CPU classique
+ICP_DEVICE = o3d.core.Device("CUDA:0") if hasattr(o3d, "t") and o3d.core.cuda.is_available() else None
+
 def principal_axes(verts):
-    cov = np.cov(verts.T)
-    eigvals, eigvecs = np.linalg.eigh(cov)
-    order = np.argsort(eigvals)[::-1]
-    axes = eigvecs[:, order]
+    # SVD mince de la matrice centrée : axes déjà triés par variance décroissante
+    centered = verts - verts.mean(axis=0)
+    _, _, Vt = np.linalg.svd(centered, full_matrices=False)
+    axes = Vt.T
     if np.linalg.det(axes) < 0:
         axes[:, -1] *= -1
     return axes
 
+def global_registration(src_pcd, tgt_pcd, voxel_size=1.0):
+    # Recalage global FPFH + RANSAC : initialisation robuste pour l'ICP (rotations résiduelles, miroirs)
+    fpfh_param = o3d.geometry.KDTreeSearchParamHybrid(radius=voxel_size*2.5, max_nn=100)
+    src_down = src_pcd.voxel_down_sample(voxel_size)
+    tgt_down = tgt_pcd.voxel_down_sample(voxel_size)
+    src_fpfh = o3d.pipelines.registration.compute_fpfh_feature(src_down, fpfh_param)
+    tgt_fpfh = o3d.pipelines.registration.compute_fpfh_feature(tgt_down, fpfh_param)
+
+    dist_thresh = voxel_size * 0.75
+    result = o3d.pipelines.registration.registration_ransac_based_on_feature_matching(
+        src_down, tgt_down, src_fpfh, tgt_fpfh,
+        mutual_filter=True,
+        max_correspondence_distance=dist_thresh,
+        estimation_method=o3d.pipelines.registration.TransformationEstimationPointToPoint(False),
+        ransac_n=4,
+        checkers=[
+            o3d.pipelines.registration.CorrespondenceCheckerBasedOnEdgeLength(0.9),
+            o3d.pipelines.registration.CorrespondenceCheckerBasedOnDistance(dist_thresh)
+        ],
+        criteria=o3d.pipelines.registration.RANSACConvergenceCriteria(100000, 0.999)
+    )
+    print(f"[RANSAC] fitness={result.fitness:.4f}, inlier_rmse={result.inlier_rmse:.4f}")
+    return result.transformation
+
 def align_meshes():
     # === 1. Chargement des deux maillages (trimesh pour PCA)
     mesh_recon = trimesh.load_mesh(recon_path)
     mesh_gt = trimesh.load_mesh(gt_path)
 
     # === 2. Centrage des deux meshes sur l'origine
-    center_recon = mesh_recon.bounding_box.centroid
-    center_gt = mesh_gt.bounding_box.centroid
+    center_recon = mesh_recon.bounds.mean(axis=0)
+    center_gt = mesh_gt.bounds.mean(axis=0)
     verts_recon_centered = mesh_recon.vertices - center_recon
     verts_gt_centered = mesh_gt.vertices - center_gt
 
@@ -39,27 +66,49 @@ def align_meshes():
     # Recaler le centre sur le GT
     verts_recon_final = verts_recon_rot + center_gt
 
-    # === 4. Sauvegarde STL aligné par PCA
-    mesh_recon_aligned = trimesh.Trimesh(vertices=verts_recon_final, faces=mesh_recon.faces, process=False)
-    mesh_recon_aligned.export(output_aligned_path)
-    print(f"✅ Mesh aligné par PCA sauvegardé : {output_aligned_path}")
+    # === 4. Maillages Open3D construits en mémoire (pas d'écriture/relecture STL intermédiaire,
+    # le fichier de sortie est écrit une seule fois après l'ICP)
+    mesh_recon_o3d = o3d.geometry.TriangleMesh(
+        o3d.utility.Vector3dVector(verts_recon_final),
+        o3d.utility.Vector3iVector(np.asarray(mesh_recon.faces, dtype=np.int32))
+    )
+    mesh_gt_o3d = o3d.geometry.TriangleMesh(
+        o3d.utility.Vector3dVector(np.asarray(mesh_gt.vertices, dtype=np.float64)),
+        o3d.utility.Vector3iVector(np.asarray(mesh_gt.faces, dtype=np.int32))
+    )
+    print("✅ Mesh aligné par PCA")
 
     # === 5. (Optionnel) Affinage par ICP (Open3D)
-    mesh_recon_o3d = o3d.io.read_triangle_mesh(output_aligned_path)
-    mesh_gt_o3d = o3d.io.read_triangle_mesh(gt_path)
     mesh_recon_o3d.compute_vertex_normals()
     mesh_gt_o3d.compute_vertex_normals()
 
-    recon_pcd = mesh_recon_o3d.sample_points_uniformly(number_of_points=100000)
-    gt_pcd = mesh_gt_o3d.sample_points_uniformly(number_of_points=100000)
+    # Nuages sous-échantillonnés sur une grille de 0.5 mm ; les normales viennent du maillage
+    # (compute_vertex_normals) et sont moyennées par voxel_down_sample
+    recon_pcd = mesh_recon_o3d.sample_points_uniformly(number_of_points=20000).voxel_down_sample(voxel_size=0.5)
+    gt_pcd = mesh_gt_o3d.sample_points_uniformly(number_of_points=20000).voxel_down_sample(voxel_size=0.5)
 
+    # Initialisation par FPFH + RANSAC, puis ICP point-à-plan (converge en bien moins d'itérations)
+    init = global_registration(recon_pcd, gt_pcd, voxel_size=1.0)
     threshold = 5.0
-    reg = o3d.pipelines.registration.registration_icp(
-        recon_pcd, gt_pcd, threshold,
-        estimation_method=o3d.pipelines.registration.TransformationEstimationPointToPoint(),
-        criteria=o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=2000)
-    )
-    mesh_recon_o3d.transform(reg.transformation)
+    if ICP_DEVICE is not None:
+        reg = o3d.t.pipelines.registration.icp(
+            o3d.t.geometry.PointCloud.from_legacy(recon_pcd).to(ICP_DEVICE),
+            o3d.t.geometry.PointCloud.from_legacy(gt_pcd).to(ICP_DEVICE),
+            threshold, o3d.core.Tensor(init),
+            o3d.t.pipelines.registration.TransformationEstimationPointToPlane(),
+            o3d.t.pipelines.registration.ICPConvergenceCriteria(
+                relative_fitness=1e-7, relative_rmse=1e-7, max_iteration=100)
+        )
+        transformation = reg.transformation.cpu().numpy()
+    else:
+        reg = o3d.pipelines.registration.registration_icp(
+            recon_pcd, gt_pcd, threshold, init,
+            estimation_method=o3d.pipelines.registration.TransformationEstimationPointToPlane(),
+            criteria=o3d.pipelines.registration.ICPConvergenceCriteria(
+                relative_fitness=1e-7, relative_rmse=1e-7, max_iteration=100)
+        )
+        transformation = reg.transformation
+    mesh_recon_o3d.transform(transformation)
     o3d.io.write_triangle_mesh(output_aligned_path, mesh_recon_o3d)
     print(f"✅ Mesh aligné affiné par ICP sauvegardé : {output_aligned_path}")
     
@@ -8,14 +8,22 @@ Usage
 -----
 python recon_align_fpfh.py recon.nii.gz ref.stl out_aligned.stl [iso]
 
-Dependencies: nibabel, numpy, scikit-image, trimesh, open3d >= 0.17
+Dependencies: nibabel, numpy, vtk >= 9, trimesh, open3d >= 0.17
 """
-import sys, json, itertools
+import sys, os, json, itertools
 import numpy as np
 import nibabel as nib
 import open3d as o3d
 import trimesh as tm
-from skimage.measure import marching_cubes
+import vtk
+from vtk.util.numpy_support import numpy_to_vtk, vtk_to_numpy
+
+# Flying Edges runs on vtkSMPTools: use the threaded backend unless VTK_SMP_BACKEND_IN_USE picks one
+if "VTK_SMP_BACKEND_IN_USE" not in os.environ:
+    vtk.vtkSMPTools.SetBackend("STDThread")
+
+# run ICP through the tensor API on the GPU when Open3D was built with CUDA
+ICP_DEVICE = o3d.core.Device("CUDA:0") if hasattr(o3d, "t") and o3d.core.cuda.is_available() else None
 
 # --- Utils: load and mesh from NIfTI
 
@@ -28,7 +36,21 @@ def load_nifti(path):
 
 
 def levelset_to_mesh(vol, iso, spacing):
-    verts, faces, _, _ = marching_cubes(vol, level=iso, spacing=spacing)
+    # multi-threaded Flying Edges instead of single-threaded skimage marching_cubes (same vertices)
+    img = vtk.vtkImageData()
+    img.SetDimensions(*vol.shape)
+    img.SetSpacing(*spacing)
+    img.GetPointData().SetScalars(numpy_to_vtk(vol.ravel(order='F'), deep=True))
+    fe = vtk.vtkFlyingEdges3D()
+    fe.SetInputData(img)
+    fe.SetValue(0, iso)
+    fe.ComputeNormalsOff()
+    fe.ComputeGradientsOff()
+    fe.ComputeScalarsOff()
+    fe.Update()
+    out = fe.GetOutput()
+    verts = vtk_to_numpy(out.GetPoints().GetData()).astype(np.float64)
+    faces = vtk_to_numpy(out.GetPolys().GetConnectivityArray()).reshape(-1, 3).astype(np.int32)
     mesh = o3d.geometry.TriangleMesh(
         o3d.utility.Vector3dVector(verts),
         o3d.utility.Vector3iVector(faces)
@@ -42,7 +64,7 @@ def apply_affine_rt_only(mesh, aff):
     R, t = aff[:3,:3], aff[:3,3]
     Rn = R / np.linalg.norm(R, axis=0)
     v = np.asarray(mesh.vertices)
-    mesh.vertices = o3d.utility.Vector3dVector((Rn @ v.T).T + t)
+    mesh.vertices = o3d.utility.Vector3dVector(v @ Rn.T + t)
     return mesh
 
 # convert mesh to point cloud by uniform sampling
@@ -63,9 +85,7 @@ def preprocess_point_cloud(pcd, voxel_size):
 
 # global RANSAC registration
 
-def global_registration(src_mesh, tgt_mesh, voxel_size):
-    src_pcd = mesh_to_pcd(src_mesh)
-    tgt_pcd = mesh_to_pcd(tgt_mesh)
+def global_registration(src_pcd, tgt_pcd, voxel_size):
     src_down, src_fpfh = preprocess_point_cloud(src_pcd, voxel_size)
     tgt_down, tgt_fpfh = preprocess_point_cloud(tgt_pcd, voxel_size)
 
@@ -86,13 +106,9 @@ def global_registration(src_mesh, tgt_mesh, voxel_size):
     print(f"[RANSAC] fitness={result.fitness:.4f}, inlier_rmse={result.inlier_rmse:.4f}")
     return result.transformation
 
-# refine with multi-scale ICP
-
-def refine_registration(src_mesh, tgt_mesh, init_trans, voxel_size):
-    src_pcd = mesh_to_pcd(src_mesh)
-    tgt_pcd = mesh_to_pcd(tgt_mesh)
-    src_pcd.transform(init_trans)
+# refine with multi-scale ICP (init_trans is applied by ICP itself, src_pcd is not modified)
 
+def refine_registration(src_pcd, tgt_pcd, init_trans, voxel_size):
     trans = init_trans.copy()
     for factor in [5.0, 1.0]:
         vs = voxel_size * factor
@@ -100,14 +116,26 @@ def refine_registration(src_mesh, tgt_mesh, init_trans, voxel_size):
         tgt_down = tgt_pcd.voxel_down_sample(vs)
         src_down.estimate_normals(o3d.geometry.KDTreeSearchParamHybrid(radius=vs*2, max_nn=30))
         tgt_down.estimate_normals(o3d.geometry.KDTreeSearchParamHybrid(radius=vs*2, max_nn=30))
-        reg = o3d.pipelines.registration.registration_icp(
-            src_down, tgt_down,
-            vs * 1.5,
-            trans,
-            o3d.pipelines.registration.TransformationEstimationPointToPlane(),
-            o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=50)
-        )
-        trans = reg.transformation
+        if ICP_DEVICE is not None:
+            # tensor ICP: nearest-neighbour search runs on the GPU, normals come from the legacy clouds
+            reg = o3d.t.pipelines.registration.icp(
+                o3d.t.geometry.PointCloud.from_legacy(src_down).to(ICP_DEVICE),
+                o3d.t.geometry.PointCloud.from_legacy(tgt_down).to(ICP_DEVICE),
+                vs * 1.5,
+                o3d.core.Tensor(trans),
+                o3d.t.pipelines.registration.TransformationEstimationPointToPlane(),
+                o3d.t.pipelines.registration.ICPConvergenceCriteria(max_iteration=50)
+            )
+            trans = reg.transformation.cpu().numpy()
+        else:
+            reg = o3d.pipelines.registration.registration_icp(
+                src_down, tgt_down,
+                vs * 1.5,
+                trans,
+                o3d.pipelines.registration.TransformationEstimationPointToPlane(),
+                o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=50)
+            )
+            trans = reg.transformation
         print(f"[ICP] voxel={vs:.3f}, fitness={reg.fitness:.4f}, rmse={reg.inlier_rmse:.4f}")
     return trans
 
@@ -118,12 +146,17 @@ def voxel_set(mesh, pitch):
         tm.Trimesh(vertices=np.asarray(mesh.vertices), faces=np.asarray(mesh.triangles)),
         pitch=pitch, method='subdivide'
     )
-    return {tuple(idx) for idx in vox.sparse_indices}
+    # pack (i,j,k) into one uint64 key (21 bits per axis) -> sorted, unique 1-D array
+    # (uniqueness is what dice_sets relies on with assume_unique=True)
+    idx = vox.sparse_indices.astype(np.uint64)
+    packed = (idx[:,0] << np.uint64(42)) | (idx[:,1] << np.uint64(21)) | idx[:,2]
+    return np.unique(packed)
 
 
 def dice_sets(A, B):
-    inter = len(A & B)
-    return 2.0 * inter / (len(A) + len(B)) if (A or B) else 0.0
+    inter = np.intersect1d(A, B, assume_unique=True).size
+    total = A.size + B.size
+    return 2.0 * inter / total if total else 0.0
 
 # main pipeline
 
@@ -138,18 +171,22 @@ def main(nii_path, ref_path, out_path, iso=0.5):
     delta = ref_mesh.get_center() - mesh.get_center()
     mesh.translate(delta)
 
+    # sample each mesh once, shared by registration and metrics
+    src_pcd = mesh_to_pcd(mesh)
+    tgt_pcd = mesh_to_pcd(ref_mesh)
+
     voxel_size = min(dx,dy,dz)
-    # global + refine
-    T_global = global_registration(mesh, ref_mesh, voxel_size)
-    mesh.transform(T_global)
-    T_icp = refine_registration(mesh, ref_mesh, T_global, voxel_size)
+    # global + refine (T_icp already includes T_global)
+    T_global = global_registration(src_pcd, tgt_pcd, voxel_size)
+    T_icp = refine_registration(src_pcd, tgt_pcd, T_global, voxel_size)
     mesh.transform(T_icp)
+    src_pcd.transform(T_icp)
 
     # metrics
     pitch = voxel_size
     dice = dice_sets(voxel_set(mesh,pitch), voxel_set(ref_mesh,pitch))
-    rms = np.sqrt(((np.asarray(mesh.sample_points_uniformly(20000).compute_point_cloud_distance(
-        mesh.sample_points_uniformly(20000)))**2).mean()))
+    # RMS of recon -> reference distances (was recon vs. a resample of itself)
+    rms = np.sqrt((np.asarray(src_pcd.compute_point_cloud_distance(tgt_pcd))**2).mean())
 
     o3d.io.write_triangle_mesh(out_path, mesh)
     print(json.dumps({"dice": dice, "rms_mm": rms}))
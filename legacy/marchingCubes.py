@@ -3,6 +3,12 @@ import SimpleITK as sitk
 import numpy as np
 import vtk
 from vtkmodules.util.numpy_support import numpy_to_vtk
+from _resample import isotropic_resample
+
+# Flying Edges est parallélisé via vtkSMPTools : backend multi-thread, sauf choix explicite
+# par la variable d'environnement VTK_SMP_BACKEND_IN_USE (ex. TBB)
+if "VTK_SMP_BACKEND_IN_USE" not in os.environ:
+    vtk.vtkSMPTools.SetBackend("STDThread")
 
 # === PARAMÈTRES ===
 nii_seg_path = "data/2Dslices/01/label.nii"  # segmentation binaire
@@ -12,31 +18,35 @@ desired_spacing = [0.5, 0.5, 0.5]  # voxels isotropes
 # === 1. Chargement et resampling isotrope ===
 img = sitk.ReadImage(nii_seg_path)
 
-resampler = sitk.ResampleImageFilter()
-resampler.SetOutputSpacing(desired_spacing)
-resampler.SetSize([int(sz*spc/dsp) for sz, spc, dsp in zip(img.GetSize(), img.GetSpacing(), desired_spacing)])
-resampler.SetInterpolator(sitk.sitkNearestNeighbor)
-resampler.SetOutputDirection(img.GetDirection())
-resampler.SetOutputOrigin(img.GetOrigin())
-resampled_img = resampler.Execute(img)
+# Recadrage sur la segmentation puis resampling (helper partagé avec Poisson.py)
+resampled_img = isotropic_resample(img, desired_spacing)
 
 # === 2. Conversion vers VTK ===
-def sitk_to_vtk_image(sitk_img):
-    arr = sitk.GetArrayFromImage(sitk_img).astype(np.uint8)
+def sitk_to_vtk_image(sitk_img, ref_img=None):
+    # GetArrayFromImage renvoie déjà une copie contiguë : pas de seconde copie (astype/deep)
+    arr = np.ascontiguousarray(sitk.GetArrayFromImage(sitk_img).astype(np.uint8, copy=False)).ravel()
     vtk_img = vtk.vtkImageData()
-    vtk_img.SetDimensions(arr.shape[2], arr.shape[1], arr.shape[0])
-    vtk_arr = numpy_to_vtk(arr.ravel(), deep=True, array_type=vtk.VTK_UNSIGNED_CHAR)
+    vtk_img.SetDimensions(*sitk_img.GetSize())
+    vtk_arr = numpy_to_vtk(arr, deep=False, array_type=vtk.VTK_UNSIGNED_CHAR)
+    # VTK partage le buffer numpy : garder une référence pour qu'il vive aussi longtemps que l'image
+    vtk_img._numpy_ref = arr
     vtk_img.GetPointData().SetScalars(vtk_arr)
     spacing = sitk_img.GetSpacing()
-    origin = sitk_img.GetOrigin()
+    origin = np.array(sitk_img.GetOrigin())
+    if ref_img is not None:
+        # La direction est ignorée ici (voxel = origine + idx*spacing) : le recadrage a déplacé
+        # l'origine de D·(lo*spacing), on la ramène à origine_ref + lo*spacing dans cette convention
+        ref_origin = np.array(ref_img.GetOrigin())
+        direction = np.array(ref_img.GetDirection()).reshape(3, 3)
+        origin = ref_origin + direction.T @ (origin - ref_origin)
     vtk_img.SetSpacing(spacing)
     vtk_img.SetOrigin(origin)
     return vtk_img
 
-vtk_image = sitk_to_vtk_image(resampled_img)
+vtk_image = sitk_to_vtk_image(resampled_img, img)
 
-# === 3. Application Marching Cubes ===
-mc = vtk.vtkMarchingCubes()
+# === 3. Application Marching Cubes (Flying Edges, même surface que vtkMarchingCubes) ===
+mc = vtk.vtkFlyingEdges3D()
 mc.SetInputData(vtk_image)
 mc.SetValue(0, 0.5)  # seuil pour binaire 0/1
 mc.Update()
@@ -44,6 +54,7 @@ mc.Update()
 # === 4. Export STL ===
 writer = vtk.vtkSTLWriter()
 writer.SetFileName(output_stl_path)
+writer.SetFileTypeToBinary()  # ~6x plus petit que l'ASCII, écriture bien plus rapide
 writer.SetInputData(mc.GetOutput())
 writer.Write()
 
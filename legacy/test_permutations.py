@@ -2,7 +2,6 @@ import trimesh
 import numpy as np
 from itertools import permutations, product
 from scipy.spatial.transform import Rotation as R
-import sys
 
 # === CHEMINS DES FICHIERS ===
 recon_path = "output/levelSet_hom.stl"
@@ -10,7 +9,19 @@ gt_path = "data/gt_stl/01/01_AORTE_arteries.stl"
 
 mesh_gt = trimesh.load_mesh(gt_path)
 verts_gt = mesh_gt.vertices
-center_gt = mesh_gt.bounding_box.centroid
+center_gt = mesh_gt.bounds.mean(axis=0)
+
+# Axes principaux à partir de la matrice de covariance 3x3 des sommets
+def principal_axes(cov):
+    eigvals, eigvecs = np.linalg.eigh(cov)
+    order = np.argsort(eigvals)[::-1]
+    axes = eigvecs[:, order]
+    if np.linalg.det(axes) < 0:
+        axes[:, -1] *= -1
+    return axes
+
+# Le GT ne change pas : ses axes sont calculés une seule fois
+axes_gt = principal_axes(np.cov(verts_gt.T))
 
 # Génère toutes les permutations d'axes (0,1,2) et toutes les combinaisons de signes (+1/-1)
 axes_perms = list(permutations([0, 1, 2]))
@@ -18,52 +29,37 @@ signs = list(product([1, -1], repeat=3))
 
 mesh_recon_orig = trimesh.load_mesh(recon_path)
 verts_orig = mesh_recon_orig.vertices
-faces = mesh_recon_orig.faces
 
-print("=== TEST DES PERMUTATIONS ET INVERSIONS D'AXES ===")
-best = None
-best_score = float('inf')
+# Seul passage O(N) sur la reconstruction : covariance et bornes des sommets d'origine.
+# Pour v' = S P v (P permutation, S signes ±1) : cov' = (S P) cov (S P)^T, et le centre de la
+# bounding box suit la même transformation.
+cov_orig = np.cov(verts_orig.T)
+center_orig = 0.5 * (verts_orig.max(axis=0) + verts_orig.min(axis=0))
 
-total = len(axes_perms) * len(signs)
-def progress_bar(j, total, size=40):
-    x = int(size*j/total)
-    sys.stdout.write("[%s%s] %i/%i\r" % ("#"*x, "."*(size-x), j, total))
-    sys.stdout.flush()
+def score_candidate(perm, sign):
+    # Permutation + signes appliqués aux statistiques 3x3, sans toucher aux sommets
+    SP = np.diag(sign) @ np.eye(3)[list(perm)]
+    center_recon = SP @ center_orig
+    translation = center_recon - center_gt
 
-count = 0
-for perm in axes_perms:
-    for sign in signs:
-        count += 1
-        progress_bar(count, total)
-        verts = verts_orig[:, perm] * sign
-        mesh_recon = trimesh.Trimesh(vertices=verts, faces=faces, process=False)
-        center_recon = mesh_recon.bounding_box.centroid
-        translation = center_recon - center_gt
+    axes_recon = principal_axes(SP @ cov_orig @ SP.T)
+    rot_matrix = axes_recon @ axes_gt.T
+    rot = R.from_matrix(rot_matrix)
+    rot_deg = rot.as_euler('xyz', degrees=True)
 
-        # Axes principaux
-        def principal_axes(mesh):
-            v = mesh.vertices - mesh.bounding_box.centroid
-            cov = np.cov(v.T)
-            eigvals, eigvecs = np.linalg.eigh(cov)
-            order = np.argsort(eigvals)[::-1]
-            axes = eigvecs[:, order]
-            if np.linalg.det(axes) < 0:
-                axes[:, -1] *= -1
-            return axes
+    # Score = norme translation + somme abs(rotation)
+    score = np.linalg.norm(translation) + np.sum(np.abs(rot_deg))
+    return score, perm, sign, translation, rot_deg
 
-        axes_recon = principal_axes(mesh_recon)
-        axes_gt = principal_axes(mesh_gt)
-        rot_matrix = axes_recon @ axes_gt.T
-        rot = R.from_matrix(rot_matrix)
-        rot_deg = rot.as_euler('xyz', degrees=True)
+print("=== TEST DES PERMUTATIONS ET INVERSIONS D'AXES ===")
+# 48 candidats de quelques opérations 3x3 chacun : évaluation séquentielle
+results = [score_candidate(p, s) for p, s in product(axes_perms, signs)]
 
-        # Score = norme translation + somme abs(rotation)
-        score = np.linalg.norm(translation) + np.sum(np.abs(rot_deg))
-        if score < best_score:
-            best_score = score
-            best = (perm, sign, translation, rot_deg)
+for score, perm, sign, translation, rot_deg in results:
+    print(f"Perm {perm}, Sign {sign} | Δcentre: {translation.round(2)} mm | Rot: {rot_deg.round(2)} deg | Score: {score:.2f}")
 
-        print(f"Perm {perm}, Sign {sign} | Δcentre: {translation.round(2)} mm | Rot: {rot_deg.round(2)} deg | Score: {score:.2f}")
+# Premier candidat de score minimal (même choix que la boucle séquentielle)
+best = min(results, key=lambda r: r[0])[1:]
 
 print("\n=== MEILLEURE CORRESPONDANCE TROUVÉE ===")
 print(f"Permutation: {best[0]}, Signe: {best[1]}")
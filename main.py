@@ -3,15 +3,17 @@ import sys
 import os
 import argparse
 
-def run_process_nifti_to_stl(nifti_path, gt_path, out_path, poisson_depth=8, seuil=0.5):
+def run_process_nifti_to_stl(nifti_path, gt_path, out_path, poisson_depth=None, seuil=0.5):
     cmd = [
         sys.executable, os.path.join("src", "process_nifti_to_stl.py"),
         "--nifti", nifti_path,
         "--gt", gt_path,
         "--out", out_path,
-        "--poisson_depth", str(poisson_depth),
         "--seuil", str(seuil)
     ]
+    # Sans profondeur explicite, le script choisit 8 (ou 7 pour les gros maillages)
+    if poisson_depth is not None:
+        cmd += ["--poisson_depth", str(poisson_depth)]
     subprocess.run(cmd, check=True)
 
 def run_comparaison(recon_path, gt_path):
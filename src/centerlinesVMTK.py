@@ -7,11 +7,13 @@ Extraction optimisée de lignes centrales d'un STL vasculaire fermé
 import vtk
 import numpy as np
 import os
-from vtk.util.numpy_support import vtk_to_numpy
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk, numpy_to_vtkIdTypeArray
 from skimage.morphology import skeletonize_3d
-import networkx as nx
 import csv
 from scipy.ndimage import binary_fill_holes
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.interpolate import splprep, splev
 
 # Paramètres par défaut, peuvent être remplacés par des variables d'environnement
 stl_file = os.environ.get("CENTERLINES_STL_FILE", "output/output_final.stl")
@@ -39,7 +41,8 @@ image.SetOrigin(bounds[0], bounds[2], bounds[4])
 image.SetSpacing(*spacing)
 image.SetDimensions(*dims)
 image.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
-image.GetPointData().GetScalars().Fill(0)
+# Initialisation via une vue numpy (écriture contiguë) plutôt que Fill() de VTK
+vtk_to_numpy(image.GetPointData().GetScalars())[...] = 0
 
 pol2stenc = vtk.vtkPolyDataToImageStencil()
 pol2stenc.SetInputData(stl_poly)
@@ -73,45 +76,87 @@ print("✅ Volume voxelisé et rempli")
 skeleton = skeletonize_3d(vol)
 idx = np.argwhere(skeleton)
 
-def world(v):
-    """Conversion voxel → coordonnées monde"""
-    return origin + np.array([v[2], v[1], v[0]]) * spacing
+# Conversion voxel (z, y, x) → coordonnées monde, une seule fois pour tout le squelette
+coords = origin + idx[:, ::-1] * np.array(spacing)
+
+def polylines_to_vtk(pts, cell_offsets, cell_conn):
+    """Construit un vtkPolyData de polylignes à partir de tableaux numpy (offsets + connectivité)"""
+    vtk_points = vtk.vtkPoints()
+    vtk_points.SetData(numpy_to_vtk(np.ascontiguousarray(pts, dtype=np.float64), deep=1))
+    vtk_lines = vtk.vtkCellArray()
+    vtk_lines.SetData(numpy_to_vtkIdTypeArray(np.asarray(cell_offsets, dtype=np.int64), deep=1),
+                      numpy_to_vtkIdTypeArray(np.asarray(cell_conn, dtype=np.int64), deep=1))
+    poly = vtk.vtkPolyData()
+    poly.SetPoints(vtk_points)
+    poly.SetLines(vtk_lines)
+    return poly
 
 # 5. Construction du graphe
-nbrs = np.array([[i,j,k] for i in (-1,0,1) for j in (-1,0,1) for k in (-1,0,1) if not (i==j==k==0)])
-voxel2i = {tuple(v): n for n, v in enumerate(idx)}
-G = nx.Graph()
+# 26-voisinage complet pour chaque voxel : les arêtes diagonales entre deux voxels ayant déjà
+# deux voisins de face peuvent relier une branche au reste du squelette
+all_nbrs = np.array([(i,j,k) for i in (-1,0,1) for j in (-1,0,1) for k in (-1,0,1) if not (i==j==k==0)])
+# Graphe stocké en CSR (scipy.sparse) : degré = indptr[n+1]-indptr[n],
+# voisins = indices[indptr[n]:indptr[n+1]]
+# Indices linéaires du squelette, déjà triés (argwhere parcourt en ordre C) : la recherche d'un
+# voisin est un searchsorted, sans volume d'étiquettes dense (mémoire en O(taille du squelette))
+lin = np.ravel_multi_index(idx.T, skeleton.shape)
+rows, cols = [], []
+
+for d in all_nbrs:
+    nb = idx + d
+    inside = np.all((nb >= 0) & (nb < skeleton.shape), axis=1)
+    src = np.flatnonzero(inside)
+    nb_lin = np.ravel_multi_index(nb[inside].T, skeleton.shape)
+    pos = np.minimum(np.searchsorted(lin, nb_lin), len(lin) - 1)
+    hit = lin[pos] == nb_lin
+    rows.append(src[hit])
+    cols.append(pos[hit])
+
+rows = np.concatenate(rows)
+cols = np.concatenate(cols)
+A = csr_matrix((np.ones(2 * len(rows), dtype=np.int8),
+                (np.concatenate([rows, cols]), np.concatenate([cols, rows]))),
+               shape=(len(idx), len(idx)))
+A.sum_duplicates()
+A.data[:] = 1
+degree = np.diff(A.indptr)
+alive = degree > 0  # noeuds présents dans le graphe (voxels isolés exclus)
+
+def neighbors(n):
+    """Voisins du noeud n dans le graphe CSR courant"""
+    return A.indices[A.indptr[n]:A.indptr[n + 1]]
 
-for n, v in enumerate(idx):
-    for d in nbrs:
-        nb = tuple(v + d)
-        if nb in voxel2i:
-            G.add_edge(n, voxel2i[nb])
+def drop_nodes(A, keep):
+    """Retire en place les noeuds hors du masque keep (les indices restent stables)"""
+    entry_rows = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    A.data[~(keep[entry_rows] & keep[A.indices])] = 0
+    A.eliminate_zeros()
+    return A
 
 # 6. Élagage intelligent des spurs
 nodes_to_remove = set()
 spurs_removed = 0
 spurs_preserved = 0
 
-for leaf in [n for n in G.nodes if G.degree[n] == 1]:
+for leaf in np.flatnonzero(degree == 1).tolist():
     if leaf in nodes_to_remove:
         continue
         
     path, cur = [leaf], leaf
     
-    while G.degree[cur] <= 2 and cur not in nodes_to_remove:
-        neighbors = [n for n in G.neighbors(cur) if n not in path]
-        if not neighbors:
+    while degree[cur] <= 2 and cur not in nodes_to_remove:
+        nbs = [n for n in neighbors(cur).tolist() if n not in path]
+        if not nbs:
             break
-        nxt = neighbors[0]
+        nxt = nbs[0]
         path.append(nxt)
         cur = nxt
-        if G.degree[cur] > 2:
+        if degree[cur] > 2:
             break
     
     # Calculer la longueur physique
     if len(path) > 1:
-        path_coords = np.array([world(idx[n]) for n in path])
+        path_coords = coords[path]
         path_length_mm = np.sum(np.linalg.norm(np.diff(path_coords, axis=0), axis=1))
     else:
         path_length_mm = 0
@@ -124,12 +169,12 @@ for leaf in [n for n in G.nodes if G.degree[n] == 1]:
     
     # Zone critique (arche aortique)
     if len(path) > 1:
-        path_coords = np.array([world(idx[n]) for n in path])
+        path_coords = coords[path]
         avg_y = np.mean(path_coords[:, 1])
         if avg_y > 0 and path_length_mm > spur_prune_mm * 0.5:
             should_preserve = True
     
-    if len(path) > 1 and G.degree[path[-1]] > 2:
+    if len(path) > 1 and degree[path[-1]] > 2:
         should_preserve = True
     
     if should_preserve:
@@ -139,40 +184,36 @@ for leaf in [n for n in G.nodes if G.degree[n] == 1]:
         spurs_removed += 1
 
 if nodes_to_remove:
-    G.remove_nodes_from(nodes_to_remove)
+    alive[list(nodes_to_remove)] = False
+    A = drop_nodes(A, alive)
 
 # 7. Gestion des composants
-components = list(nx.connected_components(G))
-components_sizes = sorted([len(c) for c in components], reverse=True)
+_, labels = connected_components(A, directed=False)
+comp_labels, comp_sizes = np.unique(labels[alive], return_counts=True)
+largest = comp_labels[[np.argmax(comp_sizes)]]
 
-if preserve_main_structure and len(components) > 1:
-    significant_components = []
-    main_size = components_sizes[0]
-    
-    for comp in components:
-        comp_size = len(comp)
-        if comp_size >= max(main_size * 0.1, 50):
-            significant_components.append(comp)
+if preserve_main_structure and len(comp_labels) > 1:
+    main_size = comp_sizes.max()
+    significant_components = comp_labels[comp_sizes >= max(main_size * 0.1, 50)]
     
     if len(significant_components) > 1:
-        all_significant_nodes = set()
-        for comp in significant_components:
-            all_significant_nodes.update(comp)
-        G = G.subgraph(all_significant_nodes).copy()
+        kept_labels = significant_components
     else:
-        largest = max(components, key=len)
-        G = G.subgraph(largest).copy()
+        kept_labels = largest
 else:
-    largest = max(components, key=len)
-    G = G.subgraph(largest).copy()
+    kept_labels = largest
+
+alive &= np.isin(labels, kept_labels)
+A = drop_nodes(A, alive)
+degree = np.diff(A.indptr)
 
 # 8. Extraction des segments
 branches = []
 visited_es = set()
-key_nodes = [n for n in G.nodes if G.degree[n] != 2]
+key_nodes = np.flatnonzero(alive & (degree != 2)).tolist()
 
 for u in key_nodes:
-    for v in G.neighbors(u):
+    for v in neighbors(u).tolist():
         if (u, v) in visited_es or (v, u) in visited_es:
             continue
         path = [u, v]
@@ -180,8 +221,8 @@ for u in key_nodes:
         visited_es.add((v, u))
         prev, cur = u, v
         
-        while G.degree[cur] == 2:
-            nxt = [w for w in G.neighbors(cur) if w != prev][0]
+        while degree[cur] == 2:
+            nxt = [w for w in neighbors(cur).tolist() if w != prev][0]
             if (cur, nxt) in visited_es:
                 break
             path.append(nxt)
@@ -190,23 +231,10 @@ for u in key_nodes:
             prev, cur = cur, nxt
         branches.append(path)
 
-# 9. Construction des lignes centrales
-points = vtk.vtkPoints()
-for v in idx:
-    coord = world(v)
-    points.InsertNextPoint(*coord)
-
-lines = vtk.vtkCellArray()
-for b in branches:
-    poly = vtk.vtkPolyLine()
-    poly.GetPointIds().SetNumberOfIds(len(b))
-    for i, vid in enumerate(b):
-        poly.GetPointIds().SetId(i, vid)
-    lines.InsertNextCell(poly)
-
-centerlines = vtk.vtkPolyData()
-centerlines.SetPoints(points)
-centerlines.SetLines(lines)
+# 9. Construction des lignes centrales (un seul transfert numpy → VTK)
+branch_offsets = np.cumsum([0] + [len(b) for b in branches])
+branch_conn = np.concatenate(branches) if branches else np.empty(0, dtype=np.int64)
+centerlines = polylines_to_vtk(coords, branch_offsets, branch_conn)
 
 # 10. Lissage
 if do_smooth:
@@ -220,14 +248,38 @@ if do_smooth:
     smoother.BoundarySmoothingOn()
     smoother.Update()
     
-    # Lissage par spline
-    spline = vtk.vtkSplineFilter()
-    spline.SetInputData(smoother.GetOutput())
-    spline.SetSubdivideToLength()
-    spline.SetLength(voxel_size_mm * 0.5)
-    spline.Update()
+    # Lissage par spline (un passage numpy par branche, pas de vtkSplineFilter)
+    smoothed = smoother.GetOutput()
+    smooth_pts = vtk_to_numpy(smoothed.GetPoints().GetData())
+    cell_offsets = vtk_to_numpy(smoothed.GetLines().GetOffsetsArray())
+    cell_conn = vtk_to_numpy(smoothed.GetLines().GetConnectivityArray())
+    step_mm = voxel_size_mm * 0.5
+    
+    spline_pts = []
+    spline_offsets = [0]
+    for start, end in zip(cell_offsets[:-1], cell_offsets[1:]):
+        P = smooth_pts[cell_conn[start:end]].astype(np.float64)
+        # Supprimer les points consécutifs dupliqués (splprep les refuse)
+        if len(P) > 1:
+            keep = np.r_[True, np.any(np.diff(P, axis=0) != 0, axis=1)]
+            P = P[keep]
+        if len(P) < 2:
+            continue
+        
+        seg = np.linalg.norm(np.diff(P, axis=0), axis=1)
+        arclen = seg.sum()
+        n_samples = max(int(np.ceil(arclen / step_mm)) + 1, 2)
+        
+        # Paramétrage par longueur d'arc → échantillonnage uniforme en mm
+        u = np.r_[0.0, np.cumsum(seg)] / arclen
+        tck, _ = splprep(P.T, u=u, s=0, k=min(3, len(P) - 1))
+        P_new = np.column_stack(splev(np.linspace(0.0, 1.0, n_samples), tck))
+        
+        spline_pts.append(P_new)
+        spline_offsets.append(spline_offsets[-1] + len(P_new))
     
-    centerlines = spline.GetOutput()
+    spline_pts = np.vstack(spline_pts) if spline_pts else np.empty((0, 3))
+    centerlines = polylines_to_vtk(spline_pts, spline_offsets, np.arange(len(spline_pts)))
     print("✅ Lissage appliqué")
 
 # 11. Export final
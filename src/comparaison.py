@@ -4,6 +4,9 @@ import trimesh
 import matplotlib.pyplot as plt
 import os
 import argparse
+import hashlib
+import tempfile
+from scipy.spatial import cKDTree
 
 # === PARAMÈTRES ===
 parser = argparse.ArgumentParser(description="Comparaison de deux meshes")
@@ -12,6 +15,30 @@ parser.add_argument('--gt', required=True, help='Chemin du mesh ground truth')
 args = parser.parse_args()
 recon_path = args.recon
 gt_path = args.gt
+cache_dir = os.path.join("output", "cache")
+
+def sample_gt_cached(mesh_gt, n_points):
+    """Échantillonne le mesh GT, avec cache disque indexé par (chemin, mtime, n_points)"""
+    key = f"{os.path.abspath(gt_path)}|{os.path.getmtime(gt_path)}|{n_points}"
+    cache_file = os.path.join(cache_dir, hashlib.md5(key.encode("utf-8")).hexdigest() + ".npy")
+
+    if os.path.exists(cache_file):
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(np.load(cache_file))
+        return pcd
+
+    pcd = mesh_gt.sample_points_uniformly(n_points)
+    # Écriture dans un temporaire puis renommage atomique : jamais de .npy tronqué sous la clé
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".npy")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.asarray(pcd.points))
+        os.replace(tmp, cache_file)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return pcd
 
 def compare_meshes():
     # === 1. Chargement des deux maillages
@@ -25,7 +52,7 @@ def compare_meshes():
     trans_init = np.identity(4)
     reg_p2p = o3d.pipelines.registration.registration_icp(
         mesh_pred.sample_points_uniformly(5000),
-        mesh_gt.sample_points_uniformly(5000),
+        sample_gt_cached(mesh_gt, 5000),
         threshold, trans_init,
         o3d.pipelines.registration.TransformationEstimationPointToPoint()
     )
@@ -33,11 +60,12 @@ def compare_meshes():
 
     # === 3. Échantillonnage des points
     points_pred = mesh_pred.sample_points_uniformly(100000)
-    points_gt = mesh_gt.sample_points_uniformly(100000)
+    points_gt = sample_gt_cached(mesh_gt, 100000)
 
-    # === 4. Calcul des distances point-surface
-    distances = points_pred.compute_point_cloud_distance(points_gt)
-    distances = np.asarray(distances)
+    # === 4. Calcul des distances point-surface (KD-tree multi-thread)
+    pts_pred = np.asarray(points_pred.points)
+    pts_gt = np.asarray(points_gt.points)
+    distances, _ = cKDTree(pts_gt).query(pts_pred, k=1, workers=-1)
 
     # === 5. Métriques
     print("✅ Comparaison terminée")
@@ -52,8 +80,7 @@ def compare_meshes():
     # === 5b. Dice score (approximation surfacique)
     dice_threshold = 1.0  # mm, à ajuster selon la précision voulue
     A_in_B = np.sum(distances < dice_threshold)
-    distances_gt = points_gt.compute_point_cloud_distance(points_pred)
-    distances_gt = np.asarray(distances_gt)
+    distances_gt, _ = cKDTree(pts_pred).query(pts_gt, k=1, workers=-1)
     B_in_A = np.sum(distances_gt < dice_threshold)
     # Correction de la formule du Dice score
     dice = (A_in_B + B_in_A) / (len(points_pred.points) + len(points_gt.points))
@@ -5,19 +5,108 @@ Calcul d'indicateurs vasculaires à partir de lignes centrales VTP
 """
 
 import vtk
+from vtk.util.numpy_support import vtk_to_numpy
 import numpy as np
 import json
 from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
 from scipy.interpolate import UnivariateSpline
 import argparse
 
+# Numba est optionnel : sans lui, on retombe sur les versions NumPy branche par branche
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# joblib est optionnel : sans lui, les branches sont traitées séquentiellement
+try:
+    from joblib import Parallel, delayed
+    HAS_JOBLIB = True
+except ImportError:
+    HAS_JOBLIB = False
+
+def map_branches(func, branches):
+    """Applique func à chaque branche, sur plusieurs threads si joblib est disponible (NumPy libère le GIL)"""
+    if HAS_JOBLIB and len(branches) > 1:
+        return Parallel(n_jobs=-1, backend='threading')(delayed(func)(branch) for branch in branches)
+    return [func(branch) for branch in branches]
+
+if HAS_NUMBA:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def path_lengths_by_blocks(pts, refs):
+        """Longueur de chaque branche, les branches étant concaténées dans pts et délimitées par refs"""
+        lengths = np.zeros(len(refs) - 1)
+        for b in prange(len(refs) - 1):
+            total = 0.0
+            for i in range(refs[b] + 1, refs[b + 1]):
+                dx = pts[i, 0] - pts[i - 1, 0]
+                dy = pts[i, 1] - pts[i - 1, 1]
+                dz = pts[i, 2] - pts[i - 1, 2]
+                total += np.sqrt(dx * dx + dy * dy + dz * dz)
+            lengths[b] = total
+        return lengths
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def max_curvatures_by_blocks(pts, refs):
+        """Courbure maximale de chaque branche (0 si la branche est trop courte)"""
+        out = np.zeros(len(refs) - 1)
+        for b in prange(len(refs) - 1):
+            s, e = refs[b], refs[b + 1]
+            best = 0.0
+            prev_t = np.zeros(3)
+            t = np.zeros(3)
+            for i in range(s + 1, e - 1):
+                # Tangente normalisée par différences centrales au point i
+                norm = 0.0
+                for k in range(3):
+                    t[k] = (pts[i + 1, k] - pts[i - 1, k]) / 2
+                    norm += t[k] * t[k]
+                norm = np.sqrt(norm)
+                for k in range(3):
+                    t[k] = t[k] / norm if norm > 0 else 0.0
+                
+                if i > s + 1:
+                    dt = 0.0
+                    ds = 0.0
+                    for k in range(3):
+                        dt += (t[k] - prev_t[k]) ** 2
+                        ds += (pts[i, k] - pts[i - 1, k]) ** 2
+                    if ds > 0:
+                        c = np.sqrt(dt) / np.sqrt(ds)
+                        if c > best:
+                            best = c
+                prev_t[:] = t
+            out[b] = best
+        return out
+
 class VascularIndicators:
     def __init__(self, vtp_file):
         """Initialise avec un fichier VTP de lignes centrales"""
         self.vtp_file = vtp_file
         self.polydata = self.load_vtp()
-        self.branches = self.extract_branches()
+        # Toutes les branches concaténées + bornes de chaque bloc (pour les noyaux Numba)
+        self._all_pts, self._offsets = self.extract_branches()
+        # Les branches sont des vues sur _all_pts (aucune copie)
+        self.branches = [self._all_pts[s:e] for s, e in zip(self._offsets[:-1], self._offsets[1:])]
+        if HAS_NUMBA:
+            self._branch_lengths = path_lengths_by_blocks(self._all_pts, self._offsets)
+        else:
+            self._branch_lengths = np.array(map_branches(self.calculate_path_length, self.branches))
+        # Étendue en Y (hauteur), réduite branche par branche sans tout concaténer
+        self._y_min = min((b[:, 1].min() for b in self.branches if len(b)), default=None)
+        self._y_max = max((b[:, 1].max() for b in self.branches if len(b)), default=None)
+        # Chemin principal = branche la plus longue
+        self._main_branch_idx = int(self._branch_lengths.argmax()) if self.branches else None
         self.bifurcations = self.find_bifurcations()
+        # Directions sortantes calculées une seule fois par couple (branche, indice du point de bifurcation)
+        self._dirs = {}
+        for bif in self.bifurcations:
+            for branch_idx, point_idx in bif['branches']:
+                if (branch_idx, point_idx) not in self._dirs:
+                    self._dirs[(branch_idx, point_idx)] = self.direction_at_index(
+                        self.branches[branch_idx], point_idx, from_bifurcation=True)
         
     def load_vtp(self):
         """Charge le fichier VTP"""
@@ -27,45 +116,58 @@ class VascularIndicators:
         return reader.GetOutput()
     
     def extract_branches(self):
-        """Extrait les branches individuelles du polydata"""
-        branches = []
-        for i in range(self.polydata.GetNumberOfCells()):
-            cell = self.polydata.GetCell(i)
-            if cell.GetCellType() == vtk.VTK_POLY_LINE:
-                points = []
-                for j in range(cell.GetNumberOfPoints()):
-                    point_id = cell.GetPointId(j)
-                    point = self.polydata.GetPoint(point_id)
-                    points.append(np.array(point))
-                branches.append(np.array(points))
-        return branches
+        """Extrait les branches du polydata : points concaténés (N, 3) et bornes (B+1,) de chaque branche"""
+        lines = self.polydata.GetLines()
+        if self.polydata.GetPoints() is None or lines.GetNumberOfCells() == 0:
+            return np.empty((0, 3)), np.zeros(1, dtype=np.int64)
+        
+        # Points et connectivité lus en une fois (pas d'appel VTK par point)
+        all_pts = vtk_to_numpy(self.polydata.GetPoints().GetData()).astype(np.float64)
+        cell_offsets = vtk_to_numpy(lines.GetOffsetsArray()).astype(np.int64)
+        conn = vtk_to_numpy(lines.GetConnectivityArray()).astype(np.int64)
+        sizes = np.diff(cell_offsets)
+        
+        # Seules les polylignes sont des branches (une cellule à 2 points est un VTK_LINE)
+        keep = sizes != 2
+        entry_keep = np.repeat(keep, sizes)
+        pts = all_pts[conn[entry_keep]]
+        offsets = np.concatenate([[0], np.cumsum(sizes[keep])]).astype(np.int64)
+        return pts, offsets
     
     def find_bifurcations(self):
         """Trouve les points de bifurcation"""
-        # Créer un dictionnaire de tous les points
-        all_points = {}
-        point_connections = {}
+        if not self.branches:
+            return []
         
-        for branch_idx, branch in enumerate(self.branches):
-            for i, point in enumerate(branch):
-                point_key = tuple(np.round(point, 3))  # Arrondir pour éviter les erreurs de précision
-                
-                if point_key not in all_points:
-                    all_points[point_key] = []
-                    point_connections[point_key] = 0
-                
-                all_points[point_key].append((branch_idx, i))
-                point_connections[point_key] += 1
+        # Tous les points des branches (déjà concaténés), avec leur origine (branche, indice local)
+        pts = self._all_pts
+        sizes = np.diff(self._offsets)
+        branch_ids = np.repeat(np.arange(len(self.branches)), sizes)
+        local_idx = np.arange(len(pts)) - np.repeat(self._offsets[:-1], sizes)
+        
+        # Arrondir au micron pour éviter les erreurs de précision, puis empaqueter (x, y, z)
+        # dans une seule clé uint64 (21 bits par axe, soit ~2 m d'étendue par axe)
+        q = np.round(pts * 1000).astype(np.int64)
+        q -= q.min(axis=0)
+        if q.max() >= (1 << 21):
+            raise ValueError("Étendue des lignes centrales trop grande pour l'empaquetage des clés")
+        q = q.astype(np.uint64)
+        keys = (q[:, 0] << np.uint64(42)) | (q[:, 1] << np.uint64(21)) | q[:, 2]
+        _, first, inv, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+        groups = np.split(np.argsort(inv, kind='stable'), np.cumsum(counts)[:-1])
+        
+        # Les bifurcations sont les points connectés à plus de 2 branches (ordre de première apparition)
+        bif_ids = np.flatnonzero(counts > 2)
+        bif_ids = bif_ids[np.argsort(first[bif_ids])]
         
-        # Les bifurcations sont les points connectés à plus de 2 branches
         bifurcations = []
-        for point_key, connections in point_connections.items():
-            if connections > 2:
-                bifurcations.append({
-                    'position': np.array(point_key),
-                    'branches': all_points[point_key],
-                    'connections': connections
-                })
+        for k in bif_ids:
+            g = groups[k]
+            bifurcations.append({
+                'position': np.round(pts[g[0]], 3),
+                'branches': list(zip(branch_ids[g].tolist(), local_idx[g].tolist())),
+                'connections': int(counts[k])
+            })
         
         return bifurcations
     
@@ -74,20 +176,12 @@ class VascularIndicators:
         if not self.branches:
             return None
         
-        # Trouver la branche la plus longue (chemin principal)
-        main_branch_idx = 0
-        max_length = 0
-        
-        for i, branch in enumerate(self.branches):
-            length = self.calculate_path_length(branch)
-            if length > max_length:
-                max_length = length
-                main_branch_idx = i
-        
+        # Branche la plus longue (chemin principal)
+        main_branch_idx = self._main_branch_idx
         main_branch = self.branches[main_branch_idx]
         
         # Longueur le long du chemin
-        path_length = self.calculate_path_length(main_branch)
+        path_length = self._branch_lengths[main_branch_idx]
         
         # Distance euclidienne entre les extrémités
         euclidean_distance = np.linalg.norm(main_branch[-1] - main_branch[0])
@@ -109,8 +203,8 @@ class VascularIndicators:
         if len(points) < 2:
             return 0
         differences = np.diff(points, axis=0)
-        distances = np.linalg.norm(differences, axis=1)
-        return np.sum(distances)
+        # einsum fusionne carré + somme sans tableau temporaire intermédiaire
+        return np.sqrt(np.einsum('ij,ij->i', differences, differences)).sum()
     
     def calculate_takeoff_angles(self):
         """Calcule les angles de décollage des branches principales"""
@@ -120,29 +214,26 @@ class VascularIndicators:
         takeoff_angles = []
         
         # Identifier l'axe principal (aorte ascendante) - généralement la branche la plus longue
-        main_branch_idx = 0
-        max_length = 0
-        for i, branch in enumerate(self.branches):
-            length = self.calculate_path_length(branch)
-            if length > max_length:
-                max_length = length
-                main_branch_idx = i
-        
+        main_branch_idx = self._main_branch_idx
         main_branch = self.branches[main_branch_idx]
         
-        for bif in self.bifurcations:
+        # Points de l'axe principal les plus proches de toutes les bifurcations
+        # (KD-tree de la seule branche principale, une seule requête)
+        bif_positions = np.array([bif['position'] for bif in self.bifurcations])
+        _, main_closest = cKDTree(main_branch).query(bif_positions)
+        
+        for bif, closest_idx in zip(self.bifurcations, main_closest):
             bif_pos = bif['position']
             
             # Trouver le vecteur direction de l'axe principal près de la bifurcation
-            main_direction = self.get_direction_vector(main_branch, bif_pos)
+            main_direction = self.direction_at_index(main_branch, closest_idx)
             
             # Pour chaque branche connectée à cette bifurcation
             for branch_idx, point_idx in bif['branches']:
                 if branch_idx == main_branch_idx:
                     continue  # Ignorer l'axe principal lui-même
                 
-                branch = self.branches[branch_idx]
-                branch_direction = self.get_direction_vector(branch, bif_pos, from_bifurcation=True)
+                branch_direction = self._dirs[(branch_idx, point_idx)]
                 
                 if main_direction is not None and branch_direction is not None:
                     angle = self.angle_between_vectors(main_direction, branch_direction)
@@ -168,38 +259,37 @@ class VascularIndicators:
             branch_indices = []
             
             for branch_idx, point_idx in bif['branches']:
-                branch = self.branches[branch_idx]
-                direction = self.get_direction_vector(branch, bif_pos, from_bifurcation=True)
+                direction = self._dirs[(branch_idx, point_idx)]
                 if direction is not None:
                     directions.append(direction)
                     branch_indices.append(branch_idx)
             
-            # Calculer les angles entre toutes les paires de directions
-            angles = []
-            for i in range(len(directions)):
-                for j in range(i + 1, len(directions)):
-                    angle = self.angle_between_vectors(directions[i], directions[j])
-                    angles.append({
-                        'branch1': branch_indices[i],
-                        'branch2': branch_indices[j],
-                        'angle_degrees': np.degrees(angle)
-                    })
+            if len(directions) < 2:
+                continue
+            
+            # Angles entre toutes les paires de directions : atan2(|a×b|, a·b), stable près de 0 et π
+            D = np.asarray(directions)
+            iu, ju = np.triu_indices(len(D), 1)
+            dots = (D @ D.T)[iu, ju]
+            crosses = np.linalg.norm(np.cross(D[iu], D[ju]), axis=1)
+            angles_deg = np.degrees(np.arctan2(crosses, dots))
             
-            if angles:
-                bifurcation_angles.append({
-                    'bifurcation_position': bif_pos,
-                    'angles': angles,
-                    'mean_angle': np.mean([a['angle_degrees'] for a in angles])
-                })
+            angles = [{
+                'branch1': branch_indices[i],
+                'branch2': branch_indices[j],
+                'angle_degrees': angle
+            } for i, j, angle in zip(iu, ju, angles_deg)]
+            
+            bifurcation_angles.append({
+                'bifurcation_position': bif_pos,
+                'angles': angles,
+                'mean_angle': angles_deg.mean()
+            })
         
         return bifurcation_angles
     
-    def get_direction_vector(self, branch, reference_point, from_bifurcation=False, segment_length=5.0):
-        """Calcule le vecteur direction d'une branche près d'un point de référence"""
-        # Trouver le point le plus proche dans la branche
-        distances = np.linalg.norm(branch - reference_point, axis=1)
-        closest_idx = np.argmin(distances)
-        
+    def direction_at_index(self, branch, closest_idx, from_bifurcation=False):
+        """Calcule le vecteur direction d'une branche autour de l'indice closest_idx"""
         if from_bifurcation:
             # Direction depuis la bifurcation vers l'extérieur
             if closest_idx < len(branch) - 1:
@@ -224,29 +314,31 @@ class VascularIndicators:
     
     def angle_between_vectors(self, v1, v2):
         """Calcule l'angle entre deux vecteurs"""
-        cos_angle = np.clip(np.dot(v1, v2), -1.0, 1.0)
-        return np.arccos(cos_angle)
+        # atan2 ne nécessite pas de clip et reste précis pour les angles proches de 0 ou π
+        return np.arctan2(np.linalg.norm(np.cross(v1, v2)), np.dot(v1, v2))
     
     def calculate_maximum_curvature(self):
         """Calcule la courbure maximale le long des lignes centrales"""
         max_curvature = 0
         max_curvature_info = None
         
-        for branch_idx, branch in enumerate(self.branches):
-            if len(branch) < 3:
-                continue
+        if HAS_NUMBA:
+            branch_max_curvatures = max_curvatures_by_blocks(self._all_pts, self._offsets)
+        else:
+            def branch_max_curvature(branch):
+                curvatures = self.calculate_curvature_along_path(branch)
+                return curvatures.max() if curvatures.size > 0 else 0
             
-            curvatures = self.calculate_curvature_along_path(branch)
-            if len(curvatures) > 0:
-                branch_max_curvature = np.max(curvatures)
-                
-                if branch_max_curvature > max_curvature:
-                    max_curvature = branch_max_curvature
-                    max_curvature_info = {
-                        'branch_index': branch_idx,
-                        'max_curvature': branch_max_curvature,
-                        'min_radius_mm': 1.0 / branch_max_curvature if branch_max_curvature > 0 else np.inf
-                    }
+            branch_max_curvatures = map_branches(branch_max_curvature, self.branches)
+        
+        for branch_idx, branch_max_curvature in enumerate(branch_max_curvatures):
+            if branch_max_curvature > max_curvature:
+                max_curvature = branch_max_curvature
+                max_curvature_info = {
+                    'branch_index': branch_idx,
+                    'max_curvature': branch_max_curvature,
+                    'min_radius_mm': 1.0 / branch_max_curvature if branch_max_curvature > 0 else np.inf
+                }
         
         if max_curvature_info:
             
@@ -257,29 +349,15 @@ class VascularIndicators:
         if len(points) < 3:
             return np.array([])
         
-        # Calculer les vecteurs tangents
-        tangents = []
-        for i in range(1, len(points) - 1):
-            # Vecteur tangent approximé par différences centrales
-            tangent = (points[i + 1] - points[i - 1]) / 2
-            norm = np.linalg.norm(tangent)
-            if norm > 0:
-                tangents.append(tangent / norm)
-            else:
-                tangents.append(np.array([0, 0, 0]))
-        
-        # Calculer la courbure
-        curvatures = []
-        for i in range(len(tangents) - 1):
-            dt = tangents[i + 1] - tangents[i]
-            ds = np.linalg.norm(points[i + 2] - points[i + 1])
-            if ds > 0:
-                curvature = np.linalg.norm(dt) / ds
-                curvatures.append(curvature)
-            else:
-                curvatures.append(0)
+        # Vecteurs tangents approximés par différences centrales, normalisés
+        tangents = (points[2:] - points[:-2]) / 2
+        norms = np.linalg.norm(tangents, axis=1, keepdims=True)
+        tangents = np.divide(tangents, norms, out=np.zeros_like(tangents), where=norms > 0)
         
-        return np.array(curvatures)
+        # Courbure = |dT| / ds
+        dt = np.linalg.norm(np.diff(tangents, axis=0), axis=1)
+        ds = np.linalg.norm(points[2:-1] - points[1:-2], axis=1)
+        return np.divide(dt, ds, out=np.zeros_like(dt), where=ds > 0)
     
     def classify_aortic_arch_type(self):
         """Classifie le type d'arche aortique (I, II, III)"""
@@ -287,10 +365,11 @@ class VascularIndicators:
         # Pour une implémentation complète, il faudrait une segmentation plus précise
         
         # Approximation basée sur la géométrie générale
-        all_points = np.vstack(self.branches)
+        if self._y_min is None:
+            raise ValueError("Aucun point de ligne centrale pour classifier l'arche aortique")
         
-        # Trouver les limites en Y (hauteur)
-        y_min, y_max = all_points[:, 1].min(), all_points[:, 1].max()
+        # Limites en Y (hauteur), calculées à l'initialisation
+        y_min, y_max = self._y_min, self._y_max
         y_range = y_max - y_min
         
         # Approximation simple basée sur la distribution des points en hauteur
@@ -338,24 +417,16 @@ class VascularIndicators:
     
     def save_results(self, indicators, output_file):
         """Sauvegarde les résultats en JSON"""
-        # Convertir les arrays numpy en listes pour la sérialisation JSON
-        def convert_for_json(obj):
+        # Conversion des types numpy à la volée pendant l'encodage (pas de copie de l'arbre)
+        def numpy_default(obj):
             if isinstance(obj, np.ndarray):
                 return obj.tolist()
-            elif isinstance(obj, np.float64) or isinstance(obj, np.float32):
-                return float(obj)
-            elif isinstance(obj, np.int64) or isinstance(obj, np.int32):
-                return int(obj)
-            elif isinstance(obj, dict):
-                return {k: convert_for_json(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [convert_for_json(item) for item in obj]
-            return obj
-        
-        json_indicators = convert_for_json(indicators)
+            elif isinstance(obj, np.generic):
+                return obj.item()
+            raise TypeError(f"Type non sérialisable en JSON : {type(obj).__name__}")
         
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(json_indicators, f, indent=2, ensure_ascii=False)
+            json.dump(indicators, f, indent=2, ensure_ascii=False, default=numpy_default)
 
 def main():
     parser = argparse.ArgumentParser(description='Calcul d\'indicateurs vasculaires à partir de lignes centrales VTP')
@@ -5,10 +5,20 @@ import open3d as o3d
 from skimage import measure
 from scipy.spatial.distance import directed_hausdorff
 
-def marching_cubes_et_poisson(chemin_nifti, seuil=0.5, profondeur=8):
+# Rotation de 180° autour de Z en coordonnées homogènes (cos π = -1, sin π = 0)
+ROTATION_Z_180 = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+# Au-delà de ce nombre de sommets, la profondeur Poisson par défaut passe de 8 à 7
+SEUIL_SOMMETS_POISSON = 500000
+
+def marching_cubes_et_poisson(chemin_nifti, seuil=0.5, profondeur=None, pas=2):
     img = nib.load(chemin_nifti)
     data = img.get_fdata()
-    verts, faces, normals, _ = measure.marching_cubes(data, level=seuil)
+    # pas > 1 : grille sous-échantillonnée (8x moins de sommets pour pas=2), lissée ensuite par Poisson
+    verts, faces, normals, _ = measure.marching_cubes(data, level=seuil, step_size=pas,
+                                                      method='lewiner', allow_degenerate=False)
+    if profondeur is None:
+        profondeur = 7 if len(verts) > SEUIL_SOMMETS_POISSON else 8
     pcd = o3d.geometry.PointCloud()
     pcd.points = o3d.utility.Vector3dVector(verts)
     pcd.normals = o3d.utility.Vector3dVector(normals)
@@ -18,42 +28,40 @@ def marching_cubes_et_poisson(chemin_nifti, seuil=0.5, profondeur=8):
 
 def appliquer_affine_sur_maillage(mesh, affine):
     sommets = np.asarray(mesh.vertices)
-    sommets_homogenes = np.hstack([sommets, np.ones((sommets.shape[0], 1))])
-    sommets_transformes = (affine @ sommets_homogenes.T).T[:, :3]
+    lineaire = affine[:3, :3]
+    if np.count_nonzero(lineaire - np.diag(np.diagonal(lineaire))) == 0:
+        # Affine diagonale (cas courant des NIfTI) : mise à l'échelle par axe, sans produit matriciel
+        sommets_transformes = sommets * np.diagonal(lineaire) + affine[:3, 3]
+    else:
+        # Partie linéaire + translation, sans passer par les coordonnées homogènes (N,4)
+        sommets_transformes = sommets @ lineaire.T + affine[:3, 3]
     mesh.vertices = o3d.utility.Vector3dVector(sommets_transformes)
     return mesh
 
-def rotation_z_180(mesh):
-    angle = np.pi
-    rotation_z = np.array([
-        [np.cos(angle), -np.sin(angle), 0],
-        [np.sin(angle),  np.cos(angle), 0],
-        [0,              0,             1]
-    ])
-    mesh.rotate(rotation_z, center=(0, 0, 0))
-    return mesh
-
 
 def main():
     parser = argparse.ArgumentParser(description="NIfTI to aligned STL with metrics.")
     parser.add_argument('--nifti', required=True, help='Chemin du fichier NIfTI')
     parser.add_argument('--gt', required=True, help='Chemin du STL ground truth')
     parser.add_argument('--out', required=True, help='Chemin du STL de sortie')
-    parser.add_argument('--poisson_depth', type=int, default=8, help='Profondeur Poisson')
+    parser.add_argument('--poisson_depth', type=int, default=None,
+                        help='Profondeur Poisson (défaut : 8, ou 7 au-delà de 500k sommets)')
     parser.add_argument('--seuil', type=float, default=0.5, help='Seuil Marching Cubes')  # Ajouté
+    parser.add_argument('--mc_step', type=int, default=2, help='Pas de la grille Marching Cubes (1 = pleine résolution)')
     args = parser.parse_args()
 
     print("1. Génération du mesh à partir du NIfTI...")
-    mesh, affine = marching_cubes_et_poisson(args.nifti, seuil=args.seuil, profondeur=args.poisson_depth)
-
-    print("2. Application de la matrice affine...")
-    mesh = appliquer_affine_sur_maillage(mesh, affine)
+    mesh, affine = marching_cubes_et_poisson(args.nifti, seuil=args.seuil, profondeur=args.poisson_depth,
+                                              pas=args.mc_step)
 
-    print("3. Rotation de 180° autour de Z...")
-    mesh = rotation_z_180(mesh)
+    print("2. Application de la matrice affine et rotation de 180° autour de Z...")
+    # Les deux transformations sont composées en une seule matrice : un seul passage sur les sommets
+    mesh = appliquer_affine_sur_maillage(mesh, ROTATION_Z_180 @ affine)
+    # Seuls les sommets sont transformés : normales (sommets et triangles) recalculées sur la géométrie finale
+    mesh.compute_vertex_normals()
     print(f"Mesh généré : {len(mesh.vertices)} sommets, {len(mesh.triangles)} triangles")
 
-    print(f"4. Sauvegarde du mesh aligné et rotationné : {args.out}")
+    print(f"3. Sauvegarde du mesh aligné et rotationné : {args.out}")
     o3d.io.write_triangle_mesh(args.out, mesh)
 
 if __name__ == "__main__":
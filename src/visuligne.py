@@ -1,57 +1,278 @@
-import vtk
 import argparse
+import os
+import hashlib
+import tempfile
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+# Imports ciblés des modules VTK utilisés (plus rapide que le paquet complet « import vtk »)
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkMultiBlockDataSet, vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkCleanPolyData, vtkQuadricDecimation
+from vtkmodules.vtkIOGeometry import vtkSTLReader
+from vtkmodules.vtkIOImage import vtkPNGWriter
+from vtkmodules.vtkIOXML import vtkXMLPolyDataReader, vtkXMLPolyDataWriter
+from vtkmodules.vtkRenderingCore import (vtkActor, vtkCompositeDataDisplayAttributes, vtkRenderer,
+                                         vtkRenderWindow, vtkRenderWindowInteractor, vtkWindowToImageFilter)
+# Enregistrement des implémentations OpenGL et des styles d'interaction (fabriques VTK)
+import vtkmodules.vtkRenderingOpenGL2
+import vtkmodules.vtkInteractionStyle
+try:
+    from vtkmodules.vtkRenderingOpenGL2 import vtkCompositePolyDataMapper2 as vtkCompositePolyDataMapper
+except ImportError:
+    from vtkmodules.vtkRenderingCore import vtkCompositePolyDataMapper
+from vtkmodules.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray, vtk_to_numpy
+
+cache_dir = os.path.join("output", "cache")
+
+def fichier_cache(chemin, extension, *params):
+    """Chemin du fichier de cache associé à (chemin absolu, mtime, paramètres)"""
+    key = "|".join(str(k) for k in (os.path.abspath(chemin), os.path.getmtime(chemin)) + params)
+    return os.path.join(cache_dir, hashlib.md5(key.encode("utf-8")).hexdigest() + extension)
+
+def ecrire_cache(cache_file, ecrire):
+    """Écrit cache_file via ecrire(chemin_temporaire) puis renommage atomique.
+
+    Un arrêt en cours d'écriture (processus tué, disque plein) ne laisse jamais de fichier
+    tronqué sous la clé de cache, seulement un temporaire orphelin.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=os.path.splitext(cache_file)[1])
+    os.close(fd)
+    try:
+        ecrire(tmp)
+        os.replace(tmp, cache_file)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def sortie_detachee(algo):
+    """Sortie d'un filtre VTK déjà exécuté, détachée du pipeline (copie superficielle).
+
+    Le mapper reçoit un polydata autonome via SetInputData : le lecteur et les filtres amont
+    (et leurs données intermédiaires) sont libérés, et aucun rendu ne revérifie le pipeline.
+    """
+    poly = vtkPolyData()
+    poly.ShallowCopy(algo.GetOutput())
+    return poly
+
+# Enregistrement d'un triangle STL binaire : normale, 3 sommets, attribut (50 octets)
+STL_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attr', '<u2')])
+
+def charger_stl(chemin):
+    """Charge un STL en vtkPolyData : lecture numpy directe si binaire, vtkSTLReader sinon (ASCII)"""
+    taille = os.path.getsize(chemin)
+    raw = np.memmap(chemin, dtype=np.uint8, mode='r') if taille >= 84 else None
+    n = int(np.frombuffer(raw[80:84], dtype='<u4')[0]) if raw is not None else -1
+    if n < 0 or taille != 84 + STL_DTYPE.itemsize * n:
+        reader = vtkSTLReader()
+        reader.SetFileName(chemin)
+        reader.Update()
+        return sortie_detachee(reader)
+
+    # Trois sommets par triangle, sans fusion des points dupliqués (pas de localisateur)
+    triangles = np.frombuffer(raw[84:], dtype=STL_DTYPE, count=n)
+    pts = np.ascontiguousarray(triangles['vertices'].reshape(-1, 3))
+    return polydata_triangles(pts, np.arange(0, 3 * n + 1, 3, dtype=np.int64), np.arange(3 * n, dtype=np.int64))
+
+def polydata_triangles(pts, offsets, conn):
+    """Construit un vtkPolyData de polygones à partir des tableaux points / offsets / connectivité"""
+    points = vtkPoints()
+    points.SetData(numpy_to_vtk(pts, deep=True))
+    polys = vtkCellArray()
+    polys.SetData(numpy_to_vtkIdTypeArray(np.asarray(offsets, dtype=np.int64), deep=True),
+                  numpy_to_vtkIdTypeArray(np.asarray(conn, dtype=np.int64), deep=True))
+    poly = vtkPolyData()
+    poly.SetPoints(points)
+    poly.SetPolys(polys)
+    return poly
+
+def ensure_binary_vtp(chemin):
+    """Renvoie une copie du VTP en binaire brut (appended, sans base64) compressé LZ4, écrite au premier appel.
+
+    Le fichier source n'est pas modifié ; la copie vit dans le cache et suit son mtime.
+    """
+    cache_file = fichier_cache(chemin, ".vtp")
+    if not os.path.exists(cache_file):
+        reader = vtkXMLPolyDataReader()
+        reader.SetFileName(chemin)
+        reader.Update()
+
+        def ecrire(tmp):
+            writer = vtkXMLPolyDataWriter()
+            writer.SetFileName(tmp)
+            writer.SetInputData(reader.GetOutput())
+            writer.SetDataModeToAppended()
+            writer.EncodeAppendedDataOff()
+            writer.SetCompressorTypeToLZ4()
+            if not writer.Write():
+                raise OSError(f"Échec d'écriture du cache VTP : {tmp}")
+
+        ecrire_cache(cache_file, ecrire)
+    return cache_file
+
+def charger_vtp(chemin):
+    """Charge un fichier VTP en vtkPolyData (via sa copie binaire en cache)"""
+    reader = vtkXMLPolyDataReader()
+    reader.SetFileName(ensure_binary_vtp(chemin))
+    # Fusion exacte des points dupliqués (extrémités partagées entre branches) avant l'envoi au GPU
+    clean = vtkCleanPolyData()
+    clean.SetInputConnection(reader.GetOutputPort())
+    clean.PointMergingOn()
+    clean.SetTolerance(0.0)
+    clean.Update()
+    poly = sortie_detachee(clean)
+    # Aucun attribut n'est affiché (couleur unie) : seuls positions et cellules partent dans les VBO
+    poly.GetPointData().Initialize()
+    poly.GetCellData().Initialize()
+    # Libère la capacité sur-allouée des tableaux (points, cellules, attributs) après lecture
+    poly.Squeeze()
+    return poly
+
+# Le STL n'est qu'un contexte semi-transparent : au-delà de ce nombre de triangles, il est décimé
+MAX_TRIANGLES_STL = 200_000
+
+def decimer(poly, max_triangles=MAX_TRIANGLES_STL):
+    """Réduit le maillage à environ max_triangles triangles (décimation quadrique), si nécessaire"""
+    n = poly.GetNumberOfCells()
+    if n <= max_triangles:
+        return poly
+    # Fusion des sommets dupliqués d'abord : la décimation a besoin de la connectivité
+    clean = vtkCleanPolyData()
+    clean.SetInputData(poly)
+    deci = vtkQuadricDecimation()
+    deci.SetInputConnection(clean.GetOutputPort())
+    deci.SetTargetReduction(1 - max_triangles / n)
+    deci.Update()
+    return sortie_detachee(deci)
+
+def charger_stl_avec_cache(chemin):
+    """Charge le STL prêt à afficher ; le résultat décimé est mis en cache disque, indexé par (chemin, mtime, seuil).
+
+    Sans décimation, rien n'est mis en cache : relire le STL binaire est plus rapide que relire les
+    tableaux (points non partagés + offsets/connectivité int64 pèsent plus lourd que le STL).
+    """
+    cache_file = fichier_cache(chemin, ".npz", MAX_TRIANGLES_STL)
+
+    if os.path.exists(cache_file):
+        with np.load(cache_file) as data:
+            return polydata_triangles(data["points"], data["offsets"], data["connectivity"])
+
+    brut = charger_stl(chemin)
+    poly = decimer(brut)
+    if poly is brut:
+        return poly
+
+    # Premier chargement d'un maillage décimé : sauvegarde des tableaux finaux
+    polys = poly.GetPolys()
+    ecrire_cache(cache_file, lambda tmp: np.savez(tmp,
+                                                  points=vtk_to_numpy(poly.GetPoints().GetData()),
+                                                  offsets=vtk_to_numpy(polys.GetOffsetsArray()),
+                                                  connectivity=vtk_to_numpy(polys.GetConnectivityArray())))
+    return poly
 
 # Ajout d'un parseur d'arguments
 parser = argparse.ArgumentParser(description='Visualisation des lignes centrales avec ou sans STL')
 parser.add_argument('--centerlines-only', action='store_true', help='Afficher uniquement les lignes centrales sans le STL')
+parser.add_argument('--offscreen', nargs='?', const='output/centerlines.png', metavar='PNG',
+                    help="Rendu hors écran sans fenêtre ni interacteur, image écrite dans PNG (défaut : %(const)s)")
 args = parser.parse_args()
 
 # Chemins des fichiers à modifier selon vos besoins
-stl_path = "output/output_final.stl"
-vtp_path = "output\centerlines_vtk.vtp"
+stl_path = str(Path("output") / "output_final.stl")
+vtp_path = str(Path("output") / "centerlines_vtk.vtp")
+
+# Un seul mapper composite pour le STL et les centerlines : un acteur, couleur/opacité par bloc
+# (vtkCompositePolyDataMapper2 sur VTK < 9.3, remplacé ensuite par vtkCompositePolyDataMapper)
+blocks = vtkMultiBlockDataSet()
+block_attributes = vtkCompositeDataDisplayAttributes()
+
+def ajouter_bloc(poly, couleur, opacite=1.0):
+    """Ajoute un polydata comme bloc du mapper composite, avec sa couleur et son opacité"""
+    blocks.SetBlock(blocks.GetNumberOfBlocks(), poly)
+    block_attributes.SetBlockColor(poly, couleur)
+    block_attributes.SetBlockOpacity(poly, opacite)
+
+# Lecture du STL (seulement si nécessaire) et des centerlines VTP en parallèle :
+# les Update() VTK relâchent le GIL, le démarrage coûte max(STL, VTP) au lieu de la somme
+with ThreadPoolExecutor(max_workers=2) as executor:
+    stl_future = None
+    if not args.centerlines_only:
+        stl_future = executor.submit(charger_stl_avec_cache, stl_path)
+    vtp_future = executor.submit(charger_vtp, vtp_path)
+    stl_poly = stl_future.result() if stl_future else None
+    vtp_poly = vtp_future.result()
 
-# Lecture du maillage STL (seulement si nécessaire)
-stl_actor = None
-if not args.centerlines_only:
-    stl_reader = vtk.vtkSTLReader()
-    stl_reader.SetFileName(stl_path)
-    stl_reader.Update()
+if stl_poly is not None:
+    ajouter_bloc(stl_poly, (0.8, 0.8, 0.8), 0.3)  # gris semi-transparent
+ajouter_bloc(vtp_poly, (1, 0, 0))  # rouge
 
-    stl_mapper = vtk.vtkPolyDataMapper()
-    stl_mapper.SetInputConnection(stl_reader.GetOutputPort())
+mapper = vtkCompositePolyDataMapper()
+mapper.SetInputDataObject(blocks)
+mapper.SetCompositeDataDisplayAttributes(block_attributes)
+# Couleurs par bloc uniquement (couleur uniforme dans le shader) : pas de table de correspondance
+# scalaires -> couleurs ni d'attribut couleur par sommet dans les VBO
+mapper.ScalarVisibilityOff()
+# Données figées après chargement : le mapper ne réexécute pas le pipeline et ne reconstruit
+# pas ses VBO à chaque rendu (aucun Modified() n'est émis sur les blocs ensuite)
+mapper.StaticOn()
 
-    stl_actor = vtk.vtkActor()
-    stl_actor.SetMapper(stl_mapper)
-    stl_actor.GetProperty().SetOpacity(0.3)  # semi-transparent
-    stl_actor.GetProperty().SetColor(0.8, 0.8, 0.8)
+def creer_acteur(mapper, **props):
+    """Crée un acteur sur un mapper existant ; props -> setters de vtkProperty (LineWidth=4 -> SetLineWidth(4)).
 
-# Lecture des centerlines VTP
-vtp_reader = vtk.vtkXMLPolyDataReader()
-vtp_reader.SetFileName(vtp_path)
-vtp_reader.Update()
+    Le mapper (et donc ses VBO) est partagé : une vue supplémentaire ne demande qu'un nouvel
+    acteur, sans nouvel envoi de la géométrie au GPU.
+    """
+    actor = vtkActor()
+    actor.SetMapper(mapper)
+    for nom, valeur in props.items():
+        getattr(actor.GetProperty(), "Set" + nom)(valeur)
+    return actor
 
-vtp_mapper = vtk.vtkPolyDataMapper()
-vtp_mapper.SetInputConnection(vtp_reader.GetOutputPort())
+# LineWidth n'affecte que les lignes (centerlines). Lignes épaisses dessinées comme des tubes
+# imposteurs dans le shader : vraie épaisseur 3D, sans géométrie supplémentaire (pas de vtkTubeFilter)
+# ni dépendance au support des lignes larges. Surface fermée : les faces arrière du STL ne sont pas
+# rastérisées (moitié moins de fragments translucides)
+actor = creer_acteur(mapper, LineWidth=4, RenderLinesAsTubes=True, BackfaceCulling=True)
 
-vtp_actor = vtk.vtkActor()
-vtp_actor.SetMapper(vtp_mapper)
-vtp_actor.GetProperty().SetColor(1, 0, 0)  # rouge
-vtp_actor.GetProperty().SetLineWidth(4)
+# Bornes de la scène calculées une seule fois, en numpy sur les tableaux de points déjà chargés
+pts_scene = [vtk_to_numpy(p.GetPoints().GetData()) for p in (vtp_poly, stl_poly) if p is not None]
+bounds = np.column_stack([np.min([p.min(axis=0) for p in pts_scene], axis=0),
+                          np.max([p.max(axis=0) for p in pts_scene], axis=0)])
 
 # Fenêtre de rendu
-renderer = vtk.vtkRenderer()
-if not args.centerlines_only and stl_actor:
-    renderer.AddActor(stl_actor)
-renderer.AddActor(vtp_actor)
+renderer = vtkRenderer()
+renderer.AddActor(actor)
 renderer.SetBackground(1, 1, 1)
+# Translucidité en une seule passe (pas de depth peeling) et anticrénelage FXAA au lieu du MSAA
+renderer.SetUseDepthPeeling(False)
+renderer.SetUseFXAA(True)
+# Caméra placée sur les bornes connues : le renderer ne reparcourt pas les points des acteurs
+renderer.ResetCamera(bounds.ravel().tolist())
 
-render_window = vtk.vtkRenderWindow()
+render_window = vtkRenderWindow()
 render_window.AddRenderer(renderer)
 render_window.SetSize(800, 600)
+render_window.SetMultiSamples(0)
 
-interactor = vtk.vtkRenderWindowInteractor()
-interactor.SetRenderWindow(render_window)
+if args.offscreen:
+    # Mode batch : contexte hors écran (EGL/OSMesa selon la compilation de VTK), capture PNG, pas de boucle
+    render_window.SetOffScreenRendering(True)
+    render_window.Render()
+    capture = vtkWindowToImageFilter()
+    capture.SetInput(render_window)
+    capture.Update()
+    png_writer = vtkPNGWriter()
+    png_writer.SetFileName(args.offscreen)
+    png_writer.SetInputConnection(capture.GetOutputPort())
+    png_writer.Write()
+    print(f"Capture enregistrée : {args.offscreen}")
+else:
+    # Premier rendu avant la création de l'interacteur (aucun observateur sur le rendu initial)
+    render_window.Render()
 
-# Lancer la visualisation
-render_window.Render()
-interactor.Start()
\ No newline at end of file
+    # Lancer la visualisation
+    interactor = vtkRenderWindowInteractor()
+    interactor.SetRenderWindow(render_window)
+    interactor.Initialize()
+    interactor.Start()
\ No newline at end of file